@@ -4,13 +4,31 @@ Dependency resolution script to avoid conflicts with ROCm-provided packages.
 Usage:
     python scripts/resolve-dependencies.py requirements.txt
     python scripts/resolve-dependencies.py pyproject.toml
+    python scripts/resolve-dependencies.py --audit [--fix]
 """
 import sys
+import os
 import re
+import json
 import tomllib
+import shutil
 import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+try:
+    from packaging.version import Version, InvalidVersion
+except ImportError:
+    Version = None
+
+# Bump when the cached distribution record shape changes
+AUDIT_SNAPSHOT_VERSION = 2
+
+# Same version installed in several environments (e.g. pip/setuptools in a
+# fresh .venv shadowing /opt/venv's copies) is reported but not a failure
+INFORMATIONAL_KINDS = {'shadowed-copy'}
+
 
 def load_rocm_packages(rocm_file="rocm-provided.txt"):
     """Load ROCm-provided packages and versions."""
@@ -161,12 +179,386 @@ def filter_pyproject_toml(pyproject_file, rocm_packages):
             print(f"  - {pkg}")
 
 
+def normalize_name(name):
+    """Normalize a distribution name (PEP 503) so torch_x, Torch-X and torch.x match."""
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def split_local_version(version):
+    """Split '2.9.1+rocm7.2' into ('2.9.1', 'rocm7.2'); local part is '' if absent."""
+    public, _, local = version.strip().partition('+')
+    # PEP 440: local labels compare case-insensitively, with - and _ equal to .
+    return public, re.sub(r'[-_]', '.', local.lower())
+
+
+def public_version_key(public):
+    """Comparison key for a public version, so 2.0 and 2.0.0 compare equal (PEP 440)."""
+    if Version is not None:
+        try:
+            return Version(public)
+        except InvalidVersion:
+            pass
+    if re.fullmatch(r'\d+(\.\d+)*', public):
+        release = [int(part) for part in public.split('.')]
+        while len(release) > 1 and release[-1] == 0:
+            release.pop()
+        return tuple(release)
+    return public.lower()
+
+
+def versions_match(installed, expected):
+    """Return True if two versions are equal, including their local build tag."""
+    installed_public, installed_local = split_local_version(installed)
+    expected_public, expected_local = split_local_version(expected)
+    return (public_version_key(installed_public) == public_version_key(expected_public)
+            and installed_local == expected_local)
+
+
+def find_site_packages():
+    """Return site-packages directories on sys.path, in import precedence order."""
+    dirs = []
+    for entry in sys.path:
+        path = Path(entry or '.').resolve()
+        if path.name in ('site-packages', 'dist-packages') and path.is_dir() and path not in dirs:
+            dirs.append(path)
+    return dirs
+
+
+def read_distribution(meta_path):
+    """Read Name/Version from a .dist-info or .egg-info entry, or None if unreadable."""
+    if meta_path.suffix == '.dist-info':
+        metadata_file = meta_path / 'METADATA'
+    elif meta_path.is_dir():
+        metadata_file = meta_path / 'PKG-INFO'
+    else:
+        metadata_file = meta_path
+
+    name = version = None
+    try:
+        with open(metadata_file, encoding='utf-8', errors='replace') as f:
+            # Only the header block is needed; stop before the long description
+            for line in f:
+                if not line.strip():
+                    break
+                if line.startswith('Name:'):
+                    name = line[5:].strip()
+                elif line.startswith('Version:'):
+                    version = line[8:].strip()
+                if name and version:
+                    break
+    except OSError:
+        return None
+
+    if not name or not version:
+        return None
+    return {
+        'name': normalize_name(name),
+        'version': version,
+        'location': str(meta_path),
+        'site_dir': str(meta_path.parent),
+    }
+
+
+def scan_installed(site_dirs, max_workers=None):
+    """Read metadata for every installed distribution in site_dirs, in parallel.
+
+    Records are returned grouped by site_dirs order (import precedence).
+    Order within one directory is not meaningful.
+    """
+    meta_paths = []
+    for site_dir in site_dirs:
+        try:
+            entries = list(os.scandir(site_dir))
+        except OSError:
+            # Directory vanished or became unreadable since discovery
+            continue
+        for entry in entries:
+            if entry.name.endswith(('.dist-info', '.egg-info')):
+                meta_paths.append(Path(entry.path))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        records = executor.map(read_distribution, meta_paths)
+    return [record for record in records if record]
+
+
+def site_packages_key(site_dirs):
+    """Build a cache key from site-packages mtimes; any install/uninstall changes it."""
+    key = {}
+    for site_dir in site_dirs:
+        try:
+            key[str(site_dir)] = site_dir.stat().st_mtime_ns
+        except OSError:
+            key[str(site_dir)] = None
+    return key
+
+
+def load_installed(site_dirs, cache_file=None):
+    """Return installed distributions, reusing the cached snapshot if nothing changed."""
+    key = site_packages_key(site_dirs)
+    cache_file = Path(cache_file) if cache_file else None
+
+    if cache_file and cache_file.exists():
+        try:
+            with open(cache_file) as f:
+                snapshot = json.load(f)
+            if snapshot.get('version') == AUDIT_SNAPSHOT_VERSION and snapshot.get('key') == key:
+                return snapshot['distributions']
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    distributions = scan_installed(site_dirs)
+
+    if cache_file:
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(cache_file, 'w') as f:
+                json.dump({'version': AUDIT_SNAPSHOT_VERSION, 'key': key, 'distributions': distributions}, f)
+        except OSError as e:
+            print(f"Warning: could not write audit cache {cache_file}: {e}")
+
+    return distributions
+
+
+def audit_installed(distributions, rocm_packages):
+    """Compare installed distributions against rocm-provided.txt pins.
+
+    Returns a list of issues. Each issue is a dict with 'kind' (one of
+    'version-drift', 'local-tag', 'duplicate', 'broken-install', or the
+    informational 'shadowed-copy'), 'name', 'expected', 'installed' (all
+    copies found, in sys.path order) and 'active' (the copy Python imports,
+    or None if it cannot be determined).
+    """
+    # Constraint lines may carry markers, comments or hashes after the version
+    pins = {normalize_name(name.strip()): re.split(r'[;#\s]', version.strip(), maxsplit=1)[0]
+            for name, version in rocm_packages.items()}
+
+    installed = {}
+    for dist in distributions:
+        installed.setdefault(dist['name'], []).append(dist)
+
+    issues = []
+    for name, expected in sorted(pins.items()):
+        copies = installed.get(name)
+        if not copies:
+            continue
+
+        def issue(kind, active):
+            return {'kind': kind, 'name': name, 'expected': expected, 'installed': copies, 'active': active}
+
+        # Python imports from the first site-packages directory holding the
+        # package. Several metadata entries in that one directory mean an
+        # interrupted or overlapping install whose files are shared, so the
+        # active copy is unknown.
+        first_dir = copies[0]['site_dir']
+        if sum(1 for dist in copies if dist['site_dir'] == first_dir) > 1:
+            issues.append(issue('broken-install', None))
+            continue
+
+        active = copies[0]
+        expected_public, expected_local = split_local_version(expected)
+        active_public, active_local = split_local_version(active['version'])
+
+        if public_version_key(active_public) != public_version_key(expected_public):
+            issues.append(issue('version-drift', active))
+        elif active_local != expected_local:
+            issues.append(issue('local-tag', active))
+
+        if len(copies) > 1:
+            if any(not versions_match(dist['version'], active['version']) for dist in copies[1:]):
+                issues.append(issue('duplicate', active))
+            else:
+                issues.append(issue('shadowed-copy', active))
+
+    return issues
+
+
+def environment_python(site_dir):
+    """Return the interpreter of the environment that owns site_dir, or None."""
+    site_dir = Path(site_dir)
+    # Expected layout: <prefix>/lib/pythonX.Y/site-packages
+    if site_dir.parent.parent.name not in ('lib', 'lib64'):
+        return None
+    bin_dir = site_dir.parent.parent.parent / 'bin'
+    for name in ('python', 'python3', site_dir.parent.name):
+        if (bin_dir / name).exists():
+            return str(bin_dir / name)
+    return None
+
+
+def installer_command(action, requirement, python, index_url=None, tool=None):
+    """Build an install/uninstall command for the environment of interpreter `python`.
+
+    Prefers uv (the container's package manager, which does not need pip in the
+    environment) and falls back to that environment's pip. Returns None if
+    neither is available.
+    """
+    if tool is None:
+        if shutil.which('uv'):
+            tool = 'uv'
+        elif (Path(python).parent / 'pip').exists():
+            tool = 'pip'
+        else:
+            return None
+
+    if tool == 'uv':
+        command = ['uv', 'pip', action, '--python', python]
+        if action == 'install':
+            command += ['--no-deps', '--reinstall']
+    else:
+        command = [python, '-m', 'pip', action]
+        command += ['--no-deps', '--force-reinstall'] if action == 'install' else ['-y']
+    if index_url:
+        command += ['--index-url', index_url]
+    return command + [requirement]
+
+
+def manual_command(action, requirement, site_dir, index_url=None):
+    """Format the uv command a user should run against the environment owning site_dir."""
+    python = environment_python(site_dir) or f"<python of the environment owning {site_dir}>"
+    return ' '.join(installer_command(action, requirement, python, index_url, tool='uv'))
+
+
+def fix_issues(issues, index_url=None):
+    """Restore the ROCm-provided version for every package with an issue.
+
+    Fixes run against the environment that owns the active copy, not the
+    interpreter running the audit. If a correct copy is still installed but
+    shadowed, the shadowing copy is uninstalled so the ROCm build becomes
+    active again. Otherwise the pinned version is reinstalled without touching
+    its dependencies. Pins with a local version tag (+rocm...) are not on PyPI,
+    so they are only reinstalled when index_url points at a ROCm wheel index.
+    Anything that cannot be fixed safely is reported with a manual command.
+
+    Returns the names of packages that were not fixed.
+    """
+    unfixed = []
+    by_name = {}
+    for issue in issues:
+        by_name.setdefault(issue['name'], issue)
+
+    for name, issue in sorted(by_name.items()):
+        expected = issue['expected']
+        active = issue['active']
+        requirement = f"{name}=={expected}"
+
+        if active is None:
+            # Uninstalling one entry would delete files shared by the others
+            site_dir = issue['installed'][0]['site_dir']
+            print(f"  - {name}: several installs in {site_dir} share files, not fixing automatically. "
+                  f"Reinstall it in that environment:")
+            print(f"      {manual_command('uninstall', name, site_dir)}")
+            print(f"      {manual_command('install', requirement, site_dir, index_url)}")
+            unfixed.append(name)
+            continue
+
+        shadowed = [dist for dist in issue['installed'] if dist is not active]
+        if versions_match(active['version'], expected):
+            print(f"  - {name}: active copy is correct, other versions are installed behind it:")
+            for dist in shadowed:
+                if not versions_match(dist['version'], expected):
+                    print(f"      {dist['version']} in {dist['site_dir']}: "
+                          f"{manual_command('uninstall', name, dist['site_dir'])}")
+            unfixed.append(name)
+            continue
+
+        python = environment_python(active['site_dir'])
+        if python is None:
+            print(f"  - {name}: cannot find the interpreter that owns {active['site_dir']}, "
+                  f"reinstall {requirement} in that environment")
+            unfixed.append(name)
+            continue
+
+        if any(versions_match(dist['version'], expected) for dist in shadowed):
+            command = installer_command('uninstall', name, python)
+        elif split_local_version(expected)[1] and not index_url:
+            print(f"  - {name}: {expected} is a ROCm build and is not available from PyPI. "
+                  f"Reinstall it from the ROCm wheel index:")
+            print(f"      {manual_command('install', requirement, active['site_dir'], '<ROCm wheel index>')}")
+            unfixed.append(name)
+            continue
+        else:
+            command = installer_command('install', requirement, python, index_url)
+
+        if command is None:
+            print(f"  - {name}: neither uv nor pip is available to fix {active['site_dir']}")
+            unfixed.append(name)
+            continue
+
+        print(f"  - {name}: {' '.join(command)}")
+        if subprocess.run(command).returncode != 0:
+            unfixed.append(name)
+
+    return unfixed
+
+
+def print_audit_report(issues):
+    """Print a human-readable summary of audit issues."""
+    labels = {
+        'version-drift': 'version drift',
+        'local-tag': 'wrong local version tag',
+        'duplicate': 'duplicate install',
+        'broken-install': 'several installs in one directory',
+        'shadowed-copy': 'same version also installed behind it',
+    }
+    for issue in issues:
+        active = issue['active']['version'] if issue['active'] else 'unknown'
+        print(f"  - {issue['name']}: {labels[issue['kind']]} "
+              f"(ROCm provides {issue['expected']}, active {active})")
+        if issue['kind'] in ('duplicate', 'broken-install'):
+            for dist in issue['installed']:
+                print(f"      {dist['version']} at {dist['location']}")
+
+
+def run_audit(rocm_packages, cache_file=None, fix=False, index_url=None):
+    """Audit installed packages against ROCm pins; returns a process exit code."""
+    if not rocm_packages:
+        print("No ROCm-provided packages to audit against")
+        return 1
+
+    site_dirs = find_site_packages()
+    distributions = load_installed(site_dirs, cache_file)
+    issues = audit_installed(distributions, rocm_packages)
+    problems = [issue for issue in issues if issue['kind'] not in INFORMATIONAL_KINDS]
+
+    notes = [issue for issue in issues if issue['kind'] in INFORMATIONAL_KINDS]
+    if notes:
+        print("Installed in more than one environment (not a problem):")
+        print_audit_report(notes)
+
+    if not problems:
+        print(f"ROCm package audit passed ({len(distributions)} installed distributions checked)")
+        return 0
+
+    print("ROCm-provided packages have been replaced or shadowed:")
+    print_audit_report(problems)
+
+    if not fix:
+        print("Re-run with --audit --fix to restore the ROCm-provided versions")
+        return 1
+
+    print("Fixing:")
+    fix_issues(problems, index_url)
+    if cache_file:
+        Path(cache_file).unlink(missing_ok=True)
+
+    # Trust the installed state, not the installers' exit codes
+    remaining = [issue for issue in audit_installed(scan_installed(site_dirs), rocm_packages)
+                 if issue['kind'] not in INFORMATIONAL_KINDS]
+    if remaining:
+        print("Still not matching the ROCm-provided versions:")
+        print_audit_report(remaining)
+        return 1
+    print("ROCm package audit passed after fixing")
+    return 0
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Filter dependencies to avoid conflicts with ROCm-provided packages"
     )
     parser.add_argument(
         "file",
+        nargs="?",
         help="Path to requirements.txt or pyproject.toml file to filter"
     )
     parser.add_argument(
@@ -174,12 +566,43 @@ if __name__ == "__main__":
         default="rocm-provided.txt",
         help="Path to rocm-provided.txt file (default: rocm-provided.txt)"
     )
+    parser.add_argument(
+        "--audit",
+        action="store_true",
+        help="Check installed packages for ROCm packages replaced or shadowed by other builds"
+    )
+    parser.add_argument(
+        "--fix",
+        action="store_true",
+        help="With --audit, reinstall or unshadow the ROCm-provided versions"
+    )
+    parser.add_argument(
+        "--audit-cache",
+        help="Snapshot of installed packages, reused while site-packages is unchanged "
+             "(default: .cache/rocm-audit.json next to the --rocm-file, empty string disables)"
+    )
+    parser.add_argument(
+        "--index-url",
+        help="With --audit --fix, package index serving the ROCm wheels (+rocm builds are not on PyPI)"
+    )
 
     args = parser.parse_args()
 
-    input_file = Path(args.file)
     rocm_packages = load_rocm_packages(args.rocm_file)
 
+    if args.audit:
+        if args.audit_cache is None:
+            audit_cache = Path(args.rocm_file).resolve().parent / '.cache' / 'rocm-audit.json'
+        else:
+            audit_cache = args.audit_cache or None
+        sys.exit(run_audit(rocm_packages, audit_cache, args.fix, args.index_url))
+    if args.fix:
+        parser.error("--fix requires --audit")
+    if not args.file:
+        parser.error("a requirements.txt or pyproject.toml file is required unless --audit is given")
+
+    input_file = Path(args.file)
+
     if input_file.suffix == '.toml':
         filter_pyproject_toml(input_file, rocm_packages)
     elif input_file.suffix == '.txt':
@@ -0,0 +1,299 @@
+"""Tests for the installed-package audit in resolve-dependencies.py."""
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+SCRIPT = next(p for p in (ROOT / 'resolve-dependencies.py', ROOT / 'scripts' / 'resolve-dependencies.py')
+              if p.exists())
+
+spec = importlib.util.spec_from_file_location('resolve_dependencies', SCRIPT)
+rd = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(rd)
+
+
+def make_env(root):
+    """Create <root>/bin/python and <root>/lib/python3.11/site-packages; return the latter."""
+    (root / 'bin').mkdir(parents=True)
+    (root / 'bin' / 'python').touch()
+    site_dir = root / 'lib' / 'python3.11' / 'site-packages'
+    site_dir.mkdir(parents=True)
+    return site_dir
+
+
+def make_dist(site_dir, name, version):
+    dist_info = site_dir / f"{name}-{version}.dist-info"
+    dist_info.mkdir(parents=True)
+    (dist_info / 'METADATA').write_text(f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n\nName: ignored\n")
+    return dist_info
+
+
+def python_of(site_dir):
+    return str(site_dir.parent.parent.parent / 'bin' / 'python')
+
+
+@pytest.fixture
+def envs(tmp_path):
+    """The container layout: project .venv first on sys.path, bridged to /opt/venv."""
+    return make_env(tmp_path / '.venv'), make_env(tmp_path / 'opt-venv')
+
+
+@pytest.fixture
+def run_calls(monkeypatch):
+    calls = []
+
+    class Result:
+        returncode = 0
+
+    def fake_run(command):
+        calls.append(command)
+        return Result()
+
+    monkeypatch.setattr(rd.subprocess, 'run', fake_run)
+    monkeypatch.setattr(rd.shutil, 'which', lambda tool: '/usr/bin/uv')
+    return calls
+
+
+def test_split_local_version():
+    assert rd.split_local_version('2.9.1+rocm7.2') == ('2.9.1', 'rocm7.2')
+    assert rd.split_local_version('2.9.1+ROCm7-2') == ('2.9.1', 'rocm7.2')
+    assert rd.split_local_version('2.0.0') == ('2.0.0', '')
+
+
+@pytest.mark.parametrize('use_packaging', [True, False])
+def test_versions_match_normalizes_public_version(monkeypatch, use_packaging):
+    if not use_packaging:
+        monkeypatch.setattr(rd, 'Version', None)
+
+    assert rd.versions_match('2.0', '2.0.0')
+    assert rd.versions_match('2.9.1+rocm7.2', '2.9.1+rocm7.2')
+    assert not rd.versions_match('2.9.1+cpu', '2.9.1+rocm7.2')
+    assert not rd.versions_match('2.0.1', '2.0.0')
+
+
+def test_pins_ignore_markers_and_trailing_zeros(envs):
+    venv, _ = envs
+    make_dist(venv, 'numpy', '2.0')
+
+    issues = rd.audit_installed(rd.scan_installed([venv]), {'numpy': '2.0.0 ; python_version >= "3.9"'})
+
+    assert issues == []
+
+
+def test_active_copy_follows_site_dir_order(envs):
+    venv, base = envs
+    make_dist(venv, 'torch', '2.9.1+cpu')
+    make_dist(base, 'torch', '2.9.1+rocm7.2')
+
+    issues = rd.audit_installed(rd.scan_installed([venv, base]), {'torch': '2.9.1+rocm7.2'})
+
+    assert [i['kind'] for i in issues] == ['local-tag', 'duplicate']
+    assert issues[0]['active']['version'] == '2.9.1+cpu'
+
+
+def test_one_finding_when_public_and_local_versions_differ(envs):
+    venv, _ = envs
+    make_dist(venv, 'torch', '2.8.0+cpu')
+
+    issues = rd.audit_installed(rd.scan_installed([venv]), {'torch': '2.9.1+rocm7.2'})
+
+    assert [i['kind'] for i in issues] == ['version-drift']
+
+
+def test_same_version_duplicate_is_informational(envs):
+    venv, base = envs
+    make_dist(venv, 'pip', '23.2.1')
+    make_dist(base, 'pip', '23.2.1')
+
+    issues = rd.audit_installed(rd.scan_installed([venv, base]), {'pip': '23.2.1'})
+
+    assert [i['kind'] for i in issues] == ['shadowed-copy']
+    assert issues[0]['kind'] in rd.INFORMATIONAL_KINDS
+
+
+def test_same_directory_duplicates_are_never_uninstalled(envs, run_calls, capsys):
+    venv, _ = envs
+    make_dist(venv, 'torch', '2.9.1+cpu')
+    make_dist(venv, 'torch', '2.9.1+rocm7.2')
+
+    issues = rd.audit_installed(rd.scan_installed([venv]), {'torch': '2.9.1+rocm7.2'})
+
+    assert [i['kind'] for i in issues] == ['broken-install']
+    assert issues[0]['active'] is None
+    assert rd.fix_issues(issues, index_url='https://rocm.example/simple') == ['torch']
+    assert run_calls == []
+    out = capsys.readouterr().out
+    assert f"uv pip uninstall --python {python_of(venv)} torch" in out
+    assert '.dist-info' not in out
+
+
+def test_fix_reinstalls_into_environment_owning_drifted_copy(envs, run_calls):
+    venv, base = envs
+    make_dist(base, 'numpy', '2.1.0')
+    issues = rd.audit_installed(rd.scan_installed([venv, base]), {'numpy': '2.0.2'})
+
+    assert rd.fix_issues(issues) == []
+    assert run_calls == [['uv', 'pip', 'install', '--python', python_of(base), '--no-deps', '--reinstall',
+                          'numpy==2.0.2']]
+
+
+def test_fix_uninstalls_shadowing_copy_from_its_environment(envs, run_calls):
+    venv, base = envs
+    make_dist(venv, 'torch', '2.9.1+cpu')
+    make_dist(base, 'torch', '2.9.1+rocm7.2')
+    issues = rd.audit_installed(rd.scan_installed([venv, base]), {'torch': '2.9.1+rocm7.2'})
+
+    assert rd.fix_issues(issues) == []
+    assert run_calls == [['uv', 'pip', 'uninstall', '--python', python_of(venv), 'torch']]
+
+
+def test_fix_reinstalls_rocm_build_only_with_index_url(envs, run_calls, capsys):
+    venv, base = envs
+    make_dist(base, 'torch', '2.9.1+cpu')
+    issues = rd.audit_installed(rd.scan_installed([venv, base]), {'torch': '2.9.1+rocm7.2'})
+
+    assert rd.fix_issues(issues) == ['torch']
+    assert run_calls == []
+    assert f"--python {python_of(base)}" in capsys.readouterr().out
+
+    assert rd.fix_issues(issues, index_url='https://rocm.example/simple') == []
+    assert run_calls == [['uv', 'pip', 'install', '--python', python_of(base), '--no-deps', '--reinstall',
+                          '--index-url', 'https://rocm.example/simple', 'torch==2.9.1+rocm7.2']]
+
+
+def test_fix_reports_other_versions_behind_correct_copy(envs, run_calls, capsys):
+    venv, base = envs
+    make_dist(venv, 'numpy', '2.0.2')
+    make_dist(base, 'numpy', '2.1.0')
+    issues = rd.audit_installed(rd.scan_installed([venv, base]), {'numpy': '2.0.2'})
+
+    assert [i['kind'] for i in issues] == ['duplicate']
+    assert rd.fix_issues(issues) == ['numpy']
+    assert run_calls == []
+    out = capsys.readouterr().out
+    assert f"uv pip uninstall --python {python_of(base)} numpy" in out
+    assert '.dist-info' not in out
+
+
+def test_fix_refuses_when_owning_interpreter_is_unknown(tmp_path, run_calls):
+    site_dir = tmp_path / 'somewhere' / 'site-packages'
+    make_dist(site_dir, 'numpy', '2.1.0')
+    issues = rd.audit_installed(rd.scan_installed([site_dir]), {'numpy': '2.0.2'})
+
+    assert rd.fix_issues(issues) == ['numpy']
+    assert run_calls == []
+
+
+def test_cache_reused_until_site_packages_changes(envs, tmp_path, monkeypatch):
+    venv, _ = envs
+    make_dist(venv, 'numpy', '2.0.2')
+    cache_file = tmp_path / '.cache' / 'rocm-audit.json'
+    scans = []
+    real_scan = rd.scan_installed
+    monkeypatch.setattr(rd, 'scan_installed', lambda dirs: scans.append(dirs) or real_scan(dirs))
+
+    first = rd.load_installed([venv], cache_file)
+    assert rd.load_installed([venv], cache_file) == first
+    assert len(scans) == 1
+
+    make_dist(venv, 'torch', '2.9.1+cpu')
+    stat = venv.stat()
+    os.utime(venv, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    assert {d['name'] for d in rd.load_installed([venv], cache_file)} == {'numpy', 'torch'}
+    assert len(scans) == 2
+
+
+def test_cache_from_older_snapshot_format_is_rescanned(envs, tmp_path):
+    venv, _ = envs
+    make_dist(venv, 'numpy', '2.0.2')
+    cache_file = tmp_path / 'rocm-audit.json'
+    stale = [{'name': 'numpy', 'version': '2.0.2', 'location': 'x'}]
+    cache_file.write_text(json.dumps({'key': rd.site_packages_key([venv]), 'distributions': stale}))
+
+    distributions = rd.load_installed([venv], cache_file)
+
+    assert distributions[0]['site_dir'] == str(venv)
+    assert rd.audit_installed(distributions, {'numpy': '2.0.2'}) == []
+
+
+def test_missing_site_dir_is_skipped(tmp_path):
+    missing = tmp_path / 'gone' / 'site-packages'
+
+    assert rd.scan_installed([missing]) == []
+    assert rd.site_packages_key([missing]) == {str(missing): None}
+
+
+def test_run_audit_passes_with_same_version_duplicates(envs, monkeypatch):
+    venv, base = envs
+    make_dist(venv, 'setuptools', '65.5.0')
+    make_dist(base, 'setuptools', '65.5.0')
+    monkeypatch.setattr(rd, 'find_site_packages', lambda: [venv, base])
+
+    assert rd.run_audit({'setuptools': '65.5.0'}) == 0
+
+
+def test_run_audit_verifies_fix_by_rescanning(envs, tmp_path, monkeypatch):
+    venv, base = envs
+    make_dist(base, 'numpy', '2.1.0')
+    cache_file = tmp_path / '.cache' / 'rocm-audit.json'
+    monkeypatch.setattr(rd, 'find_site_packages', lambda: [venv, base])
+    monkeypatch.setattr(rd.shutil, 'which', lambda tool: '/usr/bin/uv')
+
+    class Result:
+        returncode = 0
+
+    def installs_into_venv(command):
+        # Reports success but lands the pin in the wrong environment
+        make_dist(venv, 'numpy', '2.0.2')
+        return Result()
+
+    monkeypatch.setattr(rd.subprocess, 'run', installs_into_venv)
+    assert rd.run_audit({'numpy': '2.0.2'}, cache_file, fix=True) == 1
+    assert not cache_file.exists()
+
+    shutil.rmtree(venv / 'numpy-2.0.2.dist-info')
+
+    def installs_into_owner(command):
+        assert command[command.index('--python') + 1] == python_of(base)
+        shutil.rmtree(base / 'numpy-2.1.0.dist-info')
+        make_dist(base, 'numpy', '2.0.2')
+        return Result()
+
+    monkeypatch.setattr(rd.subprocess, 'run', installs_into_owner)
+    assert rd.run_audit({'numpy': '2.0.2'}, cache_file, fix=True) == 0
+
+
+def run_script(*args, cwd, env=None):
+    return subprocess.run([sys.executable, str(SCRIPT), *args], cwd=cwd, env=env,
+                          capture_output=True, text=True)
+
+
+def test_cli_fix_requires_audit(tmp_path):
+    result = run_script('--fix', cwd=tmp_path)
+
+    assert result.returncode == 2
+    assert '--fix requires --audit' in result.stderr
+
+
+def test_cli_audit_cache_defaults_next_to_rocm_file(envs, tmp_path):
+    venv, _ = envs
+    make_dist(venv, 'rocm-audit-test-pkg', '1.0')
+    workspace = tmp_path / 'workspace'
+    workspace.mkdir()
+    (workspace / 'rocm-provided.txt').write_text('rocm-audit-test-pkg==1.0\n')
+    elsewhere = tmp_path / 'elsewhere'
+    elsewhere.mkdir()
+
+    result = run_script('--audit', '--rocm-file', str(workspace / 'rocm-provided.txt'), cwd=elsewhere,
+                        env={**os.environ, 'PYTHONPATH': str(venv)})
+
+    assert result.returncode == 0, result.stdout
+    assert (workspace / '.cache' / 'rocm-audit.json').exists()
+    assert not (elsewhere / '.cache').exists()